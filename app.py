@@ -1,42 +1,223 @@
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import xlsxwriter
 import sqlite3
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
 import os
+import queue
 import tempfile
-from dateutil import parser
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.patches as mpatches
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import zip_longest
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson's C serializer
+    
+    Dates and dataclasses are passed through to Flask's default handler so
+    they serialize exactly as with the stock provider (HTTP dates). Unlike
+    the stock provider, non-ASCII text is emitted as raw UTF-8, not escaped.
+    """
+    
+    def dumps(self, obj, **kwargs):
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+DB_PATH = 'weather_data.db'
+
+# Recently fetched hourly data, keyed by the exact (latitude, longitude) that
+# was stored, so exports that follow a fetch can skip the SQLite round-trip
+CACHE_TTL_SECONDS = 900
+CACHE_MAX_ENTRIES = 256
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Recent Open-Meteo responses keyed by (rounded lat, rounded lon, end date);
+# the hourly forecast only changes hourly, so repeat calls can skip the API
+FETCH_CACHE_TTL_SECONDS = 900
+FETCH_CACHE_MAX_ENTRIES = 256
+_fetch_cache = {}
+_fetch_cache_lock = threading.Lock()
+
+# Shared HTTP session so Open-Meteo calls reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                                       max_retries=Retry(total=2, backoff_factor=0.2)))
+
+# Exports requested with ?async=1 are built on a worker pool and collected
+# later from /export/<job_id>
+JOB_TTL_SECONDS = 600
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+# PDF report styling is identical for every request, so build it once
+_STYLES = getSampleStyleSheet()
+_STATS_HEADING_STYLE = ParagraphStyle('StatsHeading', parent=_STYLES['Heading3'], alignment=TA_CENTER)
+_METADATA_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), colors.lightgrey),
+    ('BOX', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+_STATS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+def _wall_clock_epoch(moment):
+    """Encode a naive wall-clock datetime as epoch seconds, treating it as UTC"""
+    return int(moment.replace(tzinfo=timezone.utc).timestamp())
+
+def _format_tick(seconds):
+    """Label a chart tick given as epoch seconds of a naive timestamp"""
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime('%m-%d %H:%M')
+
+EXPORT_COLUMNS = ['timestamp', 'temperature_2m', 'relative_humidity_2m', 'latitude', 'longitude']
+PDF_COLUMNS = ['timestamp', 'temperature_2m', 'relative_humidity_2m']
 
 # Database setup
+# Process-wide pool of tuned connections; Werkzeug serves each request on a
+# fresh thread, so connections are checked out per use rather than per thread
+DB_POOL_SIZE = 8
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def _apply_pragmas(conn):
+    """Tune a SQLite connection for this app's write/read pattern"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('PRAGMA cache_size=-20000')
+
+@contextmanager
+def get_conn():
+    """Check out a pooled SQLite connection, opening a new one if none is idle"""
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _apply_pragmas(conn)
+    
+    try:
+        yield conn
+    finally:
+        # Never hand a half-finished transaction to the next user
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 def init_db():
     """Initialize SQLite database with weather data table"""
-    conn = sqlite3.connect('weather_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            temperature_2m REAL,
-            relative_humidity_2m REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        
+        # Timestamps used to be stored as ISO text; the table only caches
+        # re-fetchable API data, so rebuild it rather than migrate rows
+        columns = {row[1]: row[2] for row in cursor.execute('PRAGMA table_info(weather_data)')}
+        if columns.get('timestamp', 'INTEGER').upper() != 'INTEGER':
+            cursor.execute('DROP TABLE weather_data')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS weather_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp INTEGER NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                temperature_2m REAL,
+                relative_humidity_2m REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # One row per location and hour; the first time the unique index is
+        # created, drop any duplicates left by older versions
+        indexes = {row[1] for row in cursor.execute('PRAGMA index_list(weather_data)')}
+        if 'ux_wd' not in indexes:
+            cursor.execute('''
+                DELETE FROM weather_data WHERE id NOT IN (
+                    SELECT MAX(id) FROM weather_data GROUP BY latitude, longitude, timestamp
+                )
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_wd_loc_ts')
+            cursor.execute('''
+                CREATE UNIQUE INDEX ux_wd
+                ON weather_data (latitude, longitude, timestamp)
+            ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_wd_ts ON weather_data (timestamp)')
+        
+        # Schema version 1 encodes wall-clock times as UTC epochs; rows written
+        # with the server's timezone would be shifted, so drop them for re-fetch
+        if cursor.execute('PRAGMA user_version').fetchone()[0] < 1:
+            cursor.execute('DELETE FROM weather_data')
+            cursor.execute('PRAGMA user_version = 1')
+        conn.commit()
 
 def fetch_weather_data(latitude, longitude):
+    """Fetch weather data for the past 2 days, reusing a recent response if any
+    
+    Coordinates are rounded to 2 decimals (roughly 1 km, finer than the
+    forecast grid) so nearby requests share a cached response.
+    """
+    end_date = datetime.now().date()
+    key = (round(latitude, 2), round(longitude, 2), end_date.isoformat())
+    
+    with _fetch_cache_lock:
+        entry = _fetch_cache.get(key)
+    if entry is not None and time.time() - entry[0] <= FETCH_CACHE_TTL_SECONDS:
+        return entry[1]
+    
+    data = _fetch_weather_data(key[0], key[1], end_date)
+    
+    with _fetch_cache_lock:
+        if len(_fetch_cache) >= FETCH_CACHE_MAX_ENTRIES and key not in _fetch_cache:
+            # Evict the oldest response to bound memory
+            oldest = min(_fetch_cache, key=lambda k: _fetch_cache[k][0])
+            del _fetch_cache[oldest]
+        _fetch_cache[key] = (time.time(), data)
+    return data
+
+def _fetch_weather_data(latitude, longitude, end_date):
     """Fetch weather data from Open-Meteo API for the past 2 days"""
     # Calculate date range for past 2 days
-    end_date = datetime.now().date()
     start_date = end_date - timedelta(days=2)
     
     # Open-Meteo API URL - using standard forecast endpoint
@@ -51,7 +232,7 @@ def fetch_weather_data(latitude, longitude):
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = _SESSION.get(url, params=params, timeout=(3, 10))
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -59,30 +240,164 @@ def fetch_weather_data(latitude, longitude):
 
 def store_weather_data(data, latitude, longitude):
     """Store weather data in SQLite database"""
-    conn = sqlite3.connect('weather_data.db')
-    cursor = conn.cursor()
-    
-    # Clear existing data for this location
-    cursor.execute('DELETE FROM weather_data WHERE latitude = ? AND longitude = ?', 
-                   (latitude, longitude))
-    
-    # Insert new data
     hourly_data = data.get('hourly', {})
     timestamps = hourly_data.get('time', [])
     temperatures = hourly_data.get('temperature_2m', [])
     humidity = hourly_data.get('relative_humidity_2m', [])
     
-    for i, timestamp in enumerate(timestamps):
-        temp = temperatures[i] if i < len(temperatures) else None
-        humid = humidity[i] if i < len(humidity) else None
-        
-        cursor.execute('''
+    # Timestamps are stored as epoch seconds so range queries can use the index;
+    # they are the location's wall-clock times, so they're encoded as UTC to
+    # stay unique and unshifted across the server's DST changes
+    rows = [
+        (_wall_clock_epoch(datetime.fromisoformat(timestamp)), latitude, longitude, temp, humid)
+        for timestamp, temp, humid in zip_longest(timestamps, temperatures, humidity)
+        if timestamp is not None
+    ]
+    
+    # Upsert data for this location in a single transaction
+    with get_conn() as conn, conn:
+        conn.executemany('''
             INSERT INTO weather_data (timestamp, latitude, longitude, temperature_2m, relative_humidity_2m)
             VALUES (?, ?, ?, ?, ?)
-        ''', (timestamp, latitude, longitude, temp, humid))
+            ON CONFLICT (latitude, longitude, timestamp) DO UPDATE SET
+                temperature_2m = excluded.temperature_2m,
+                relative_humidity_2m = excluded.relative_humidity_2m
+        ''', rows)
+    
+    key = (latitude, longitude)
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES and key not in _cache:
+            # Evict the oldest entry to bound memory
+            oldest = min(_cache, key=lambda k: _cache[k][0])
+            del _cache[oldest]
+        _cache[key] = (time.time(), hourly_data)
+
+def get_cached_hourly_data(latitude, longitude):
+    """Return cached hourly data for a location, or None if missing or stale"""
+    key = (latitude, longitude)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and time.time() - entry[0] > CACHE_TTL_SECONDS:
+            del _cache[key]
+            entry = None
+    return entry[1] if entry is not None else None
+
+def load_export_data(cutoff_time, latitude=None, longitude=None, columns=EXPORT_COLUMNS):
+    """Load the given columns of weather data newer than cutoff_time as a DataFrame
+    
+    When a location is given and was fetched recently, the frame is built
+    from the cached API response instead of reading it back from SQLite.
+    """
+    if latitude is not None and longitude is not None:
+        hourly_data = get_cached_hourly_data(latitude, longitude)
+        if hourly_data is not None:
+            timestamps = hourly_data.get('time', [])
+            # Pad short value arrays with NaN, as the SQLite path does with zip_longest
+            hours = range(len(timestamps))
+            df = pd.DataFrame({
+                'timestamp': timestamps,
+                'temperature_2m': pd.Series(hourly_data.get('temperature_2m', []), dtype=float).reindex(hours),
+                'relative_humidity_2m': pd.Series(hourly_data.get('relative_humidity_2m', []), dtype=float).reindex(hours),
+                'latitude': latitude,
+                'longitude': longitude,
+            }, columns=columns)
+            # Compare full datetimes, as the SQLite path compares epoch seconds
+            parsed = pd.to_datetime(df['timestamp'], format='%Y-%m-%dT%H:%M')
+            return df[parsed >= pd.Timestamp(cutoff_time)].reset_index(drop=True)
     
-    conn.commit()
-    conn.close()
+    params = [_wall_clock_epoch(cutoff_time)]
+    location_filter = ''
+    if latitude is not None and longitude is not None:
+        location_filter = 'AND latitude = ? AND longitude = ?'
+        params += [latitude, longitude]
+    
+    select_list = ', '.join(
+        "strftime('%Y-%m-%dT%H:%M', timestamp, 'unixepoch') AS timestamp"
+        if column == 'timestamp' else column
+        for column in columns
+    )
+    query = f'''
+        SELECT {select_list}
+        FROM weather_data 
+        WHERE weather_data.timestamp >= ? {location_filter}
+        ORDER BY weather_data.timestamp
+    '''
+    
+    with get_conn() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return pd.DataFrame(rows, columns=columns)
+
+def load_export_location(cutoff_time):
+    """Return (latitude, longitude) of the earliest reading newer than cutoff_time"""
+    with get_conn() as conn:
+        return conn.execute('''
+            SELECT latitude, longitude
+            FROM weather_data
+            WHERE timestamp >= ?
+            ORDER BY timestamp
+            LIMIT 1
+        ''', (_wall_clock_epoch(cutoff_time),)).fetchone()
+
+def build_line_chart(timestamps, values, width, title, y_label, color, x_label=None):
+    """Build a titled line chart of a time series as a reportlab Drawing"""
+    series = pd.DataFrame({'t': timestamps, 'v': values}).dropna()
+    # Plot against epoch seconds; naive timestamps round-trip through UTC unchanged
+    seconds = (series['t'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    points = list(zip(seconds.tolist(), series['v'].tolist()))
+    
+    height = 70 * mm
+    drawing = Drawing(width, height)
+    drawing.add(String(width / 2, height - 12, title, fontName='Helvetica-Bold',
+                       fontSize=11, textAnchor='middle'))
+    # Vertical axis label, rotated 90 degrees around the plot's vertical centre
+    drawing.add(Group(String(0, 0, y_label, fontName='Helvetica-Bold', fontSize=9,
+                             fillColor=color, textAnchor='middle'),
+                      transform=(0, 1, -1, 0, 10, 16 * mm + (height - 30 * mm) / 2)))
+    if x_label:
+        drawing.add(String(16 * mm + (width - 20 * mm) / 2, 0, x_label, fontName='Helvetica-Bold',
+                           fontSize=9, textAnchor='middle'))
+    
+    if not points:
+        # Nothing to plot; reportlab's LinePlot cannot scale an empty series
+        drawing.add(String(width / 2, height / 2, 'No data available', fontName='Helvetica',
+                           fontSize=10, fillColor=colors.grey, textAnchor='middle'))
+        return drawing
+    
+    plot = LinePlot()
+    plot.x, plot.y = 16 * mm, 16 * mm
+    plot.width, plot.height = width - 20 * mm, height - 30 * mm
+    plot.data = [points]
+    plot.lines[0].strokeColor = color
+    plot.lines[0].strokeWidth = 2
+    
+    # Explicit axis ranges, widened when a series is a single point or flat
+    step = 6 * 3600
+    first, last = points[0][0], points[-1][0]
+    if first == last:
+        first, last = first - step // 2, last + step // 2
+    low, high = series['v'].min(), series['v'].max()
+    if low == high:
+        low, high = low - 1, high + 1
+    plot.xValueAxis.valueMin, plot.xValueAxis.valueMax = first, last
+    plot.yValueAxis.valueMin, plot.yValueAxis.valueMax = low, high
+    
+    # Major ticks every 6 hours, labelled like the data timestamps
+    plot.xValueAxis.valueSteps = list(range(-(-first // step) * step, last + 1, step))
+    plot.xValueAxis.labelTextFormat = _format_tick
+    plot.xValueAxis.labels.angle = 45
+    plot.xValueAxis.labels.boxAnchor = 'ne'
+    plot.xValueAxis.labels.fontName = 'Helvetica'
+    plot.xValueAxis.labels.fontSize = 7
+    plot.xValueAxis.visibleGrid = True
+    plot.xValueAxis.gridStrokeColor = colors.lightgrey
+    plot.yValueAxis.labels.fillColor = color
+    plot.yValueAxis.labels.fontName = 'Helvetica'
+    plot.yValueAxis.labels.fontSize = 8
+    plot.yValueAxis.visibleGrid = True
+    plot.yValueAxis.gridStrokeColor = colors.lightgrey
+    
+    drawing.add(plot)
+    return drawing
 
 @app.route('/weather-report')
 def weather_report():
@@ -122,165 +437,175 @@ def weather_report():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_excel(cutoff_time, latitude=None, longitude=None):
+    """Build the Excel export, or return None if there is no data to export"""
+    # Get the last 48 hours of data
+    df = load_export_data(cutoff_time, latitude, longitude)
+    
+    if df.empty:
+        return None
+    
+    # Create Excel file in memory, streaming rows in order so xlsxwriter
+    # can flush each one in constant_memory mode
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Weather Data')
+    worksheet.write_row(0, 0, df.columns)
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False)
+    for row_idx, row in enumerate(rows, start=1):
+        worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+    
+    output.seek(0)
+    return output
+
+def build_pdf(cutoff_time, latitude=None, longitude=None):
+    """Build the PDF report, or return None if there is no data to report"""
+    # Get the last 48 hours of data; the report only needs location once
+    df = load_export_data(cutoff_time, latitude, longitude, columns=PDF_COLUMNS)
+    
+    if df.empty:
+        return None
+    
+    if latitude is None or longitude is None:
+        latitude, longitude = load_export_location(cutoff_time)
+    
+    # Parse timestamps
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%dT%H:%M', cache=True)
+    
+    # Create PDF with reportlab
+    pdf_output = BytesIO()
+    doc = SimpleDocTemplate(pdf_output, pagesize=A4, title='Weather Data Report',
+                            leftMargin=15 * mm, rightMargin=15 * mm,
+                            topMargin=15 * mm, bottomMargin=15 * mm)
+    story = [Paragraph('Weather Data Report', _STYLES['Title'])]
+    
+    # Metadata section
+    location_info = f"Location: Lat {latitude:.2f}°, Lon {longitude:.2f}°"
+    date_range = f"Date Range: {df['timestamp'].min().strftime('%Y-%m-%d %H:%M')} to {df['timestamp'].max().strftime('%Y-%m-%d %H:%M')}"
+    data_points = f"Data Points: {len(df)} hourly measurements"
+    generated = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    
+    metadata = Table([[Paragraph(f"{location_info}<br/>{date_range}<br/>{data_points}<br/>{generated}",
+                                 _STYLES['Normal'])]], colWidths=[doc.width * 0.8])
+    metadata.setStyle(_METADATA_STYLE)
+    story += [metadata, Spacer(1, 8 * mm)]
+    
+    # Temperature and humidity charts
+    story.append(build_line_chart(df['timestamp'], df['temperature_2m'], doc.width,
+                                  'Temperature Trend - Last 48 Hours', 'Temperature (°C)', colors.red))
+    story.append(Spacer(1, 6 * mm))
+    story.append(build_line_chart(df['timestamp'], df['relative_humidity_2m'], doc.width,
+                                  'Humidity Trend - Last 48 Hours', 'Relative Humidity (%)', colors.blue,
+                                  x_label='Time'))
+    story.append(Spacer(1, 8 * mm))
+    
+    # Create statistics in one NumPy pass per column
+    t = df['temperature_2m'].to_numpy(dtype=float)
+    h = df['relative_humidity_2m'].to_numpy(dtype=float)
+    t_mean, t_max, t_min = np.nanmean(t), np.nanmax(t), np.nanmin(t)
+    h_mean, h_max, h_min = np.nanmean(h), np.nanmax(h), np.nanmin(h)
+    
+    stats_data = [
+        ['Metric', 'Temperature (°C)', 'Humidity (%)'],
+        ['Average', f"{t_mean:.1f}", f"{h_mean:.1f}"],
+        ['Maximum', f"{t_max:.1f}", f"{h_max:.1f}"],
+        ['Minimum', f"{t_min:.1f}", f"{h_min:.1f}"],
+        ['Range', f"{t_max - t_min:.1f}", f"{h_max - h_min:.1f}"]
+    ]
+    
+    # Statistics table
+    table = Table(stats_data, colWidths=[doc.width * 0.8 / 3] * 3)
+    table.setStyle(_STATS_TABLE_STYLE)
+    story += [Paragraph('Summary Statistics', _STATS_HEADING_STYLE), table]
+    
+    doc.build(story)
+    
+    pdf_output.seek(0)
+    return pdf_output
+
+def submit_export_job(kind, builder, cutoff_time, latitude, longitude):
+    """Queue an export on the worker pool and return its job id"""
+    job_id = uuid.uuid4().hex
+    future = _executor.submit(builder, cutoff_time, latitude, longitude)
+    now = time.time()
+    with _jobs_lock:
+        # Forget finished jobs nobody came back for
+        for stale_id, (_, stale_future, created) in list(_jobs.items()):
+            if stale_future.done() and now - created > JOB_TTL_SECONDS:
+                del _jobs[stale_id]
+        _jobs[job_id] = (kind, future, now)
+    return job_id
+
+EXPORTS = {
+    'excel': (build_excel, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'weather_data.xlsx'),
+    'pdf': (build_pdf, 'application/pdf', 'weather_report.pdf'),
+}
+
+def run_export(kind):
+    """Build an export inline, or queue it when the client asks for async"""
+    builder, mimetype, download_name = EXPORTS[kind]
+    
+    # Optional location filter
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    
+    # Calculate cutoff time (48 hours ago)
+    cutoff_time = datetime.now() - timedelta(hours=48)
+    
+    if request.args.get('async', type=int):
+        job_id = submit_export_job(kind, builder, cutoff_time, lat, lon)
+        return jsonify({'job_id': job_id, 'status_url': f'/export/{job_id}'}), 202
+    
+    output = builder(cutoff_time, lat, lon)
+    if output is None:
+        return jsonify({'error': 'No data available for the last 48 hours'}), 404
+    
+    return send_file(output, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
 @app.route('/export/excel')
 def export_excel():
     """Export last 48 hours of weather data to Excel file"""
     try:
-        # Get the last 48 hours of data
-        conn = sqlite3.connect('weather_data.db')
-        
-        # Calculate cutoff time (48 hours ago)
-        cutoff_time = datetime.now() - timedelta(hours=48)
-        
-        query = '''
-            SELECT timestamp, temperature_2m, relative_humidity_2m, latitude, longitude
-            FROM weather_data 
-            WHERE datetime(timestamp) >= datetime(?)
-            ORDER BY timestamp
-        '''
-        
-        df = pd.read_sql_query(query, conn, params=(cutoff_time.isoformat(),))
-        conn.close()
-        
-        if df.empty:
-            return jsonify({'error': 'No data available for the last 48 hours'}), 404
-        
-        # Create Excel file in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Weather Data', index=False)
-        
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='weather_data.xlsx'
-        )
-        
+        return run_export('excel')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/export/pdf')
 def export_pdf():
-    """Generate PDF report with weather data chart using matplotlib"""
+    """Generate PDF report with weather data charts using reportlab"""
     try:
-        # Get the last 48 hours of data
-        conn = sqlite3.connect('weather_data.db')
-        
-        cutoff_time = datetime.now() - timedelta(hours=48)
-        
-        query = '''
-            SELECT timestamp, temperature_2m, relative_humidity_2m, latitude, longitude
-            FROM weather_data 
-            WHERE datetime(timestamp) >= datetime(?)
-            ORDER BY timestamp
-        '''
-        
-        df = pd.read_sql_query(query, conn, params=(cutoff_time.isoformat(),))
-        conn.close()
-        
-        if df.empty:
-            return jsonify({'error': 'No data available for the last 48 hours'}), 404
-        
-        # Parse timestamps
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Create PDF with matplotlib
-        pdf_output = BytesIO()
-        
-        with PdfPages(pdf_output) as pdf:
-            # Create figure with multiple subplots
-            fig = plt.figure(figsize=(12, 16))
-            
-            # Title page
-            fig.suptitle('Weather Data Report', fontsize=20, fontweight='bold', y=0.95)
-            
-            # Metadata section
-            ax_meta = plt.subplot(4, 1, 1)
-            ax_meta.axis('off')
-            
-            location_info = f"Location: Lat {df['latitude'].iloc[0]:.2f}°, Lon {df['longitude'].iloc[0]:.2f}°"
-            date_range = f"Date Range: {df['timestamp'].min().strftime('%Y-%m-%d %H:%M')} to {df['timestamp'].max().strftime('%Y-%m-%d %H:%M')}"
-            data_points = f"Data Points: {len(df)} hourly measurements"
-            generated = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            metadata_text = f"{location_info}\n{date_range}\n{data_points}\n{generated}"
-            ax_meta.text(0.1, 0.5, metadata_text, fontsize=12, verticalalignment='center',
-                        bbox=dict(boxstyle="round,pad=0.5", facecolor="lightgray", alpha=0.8))
-            
-            # Temperature chart
-            ax1 = plt.subplot(4, 1, 2)
-            ax1.plot(df['timestamp'], df['temperature_2m'], 'r-', linewidth=2, label='Temperature (°C)')
-            ax1.set_ylabel('Temperature (°C)', color='red', fontweight='bold')
-            ax1.tick_params(axis='y', labelcolor='red')
-            ax1.grid(True, alpha=0.3)
-            ax1.set_title('Temperature Trend - Last 48 Hours', fontweight='bold')
-            
-            # Format x-axis for temperature
-            ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
-            ax1.xaxis.set_major_locator(mdates.HourLocator(interval=6))
-            plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
-            
-            # Humidity chart
-            ax2 = plt.subplot(4, 1, 3)
-            ax2.plot(df['timestamp'], df['relative_humidity_2m'], 'b-', linewidth=2, label='Humidity (%)')
-            ax2.set_ylabel('Relative Humidity (%)', color='blue', fontweight='bold')
-            ax2.tick_params(axis='y', labelcolor='blue')
-            ax2.grid(True, alpha=0.3)
-            ax2.set_title('Humidity Trend - Last 48 Hours', fontweight='bold')
-            ax2.set_xlabel('Time', fontweight='bold')
-            
-            # Format x-axis for humidity
-            ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
-            ax2.xaxis.set_major_locator(mdates.HourLocator(interval=6))
-            plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
-            
-            # Statistics table
-            ax3 = plt.subplot(4, 1, 4)
-            ax3.axis('off')
-            
-            # Create statistics
-            stats_data = [
-                ['Metric', 'Temperature (°C)', 'Humidity (%)'],
-                ['Average', f"{df['temperature_2m'].mean():.1f}", f"{df['relative_humidity_2m'].mean():.1f}"],
-                ['Maximum', f"{df['temperature_2m'].max():.1f}", f"{df['relative_humidity_2m'].max():.1f}"],
-                ['Minimum', f"{df['temperature_2m'].min():.1f}", f"{df['relative_humidity_2m'].min():.1f}"],
-                ['Range', f"{df['temperature_2m'].max() - df['temperature_2m'].min():.1f}", 
-                 f"{df['relative_humidity_2m'].max() - df['relative_humidity_2m'].min():.1f}"]
-            ]
-            
-            # Create table
-            table = ax3.table(cellText=stats_data[1:], colLabels=stats_data[0], 
-                             cellLoc='center', loc='center', bbox=[0.1, 0.3, 0.8, 0.4])
-            table.auto_set_font_size(False)
-            table.set_fontsize(10)
-            table.scale(1, 2)
-            
-            # Style the table
-            for i in range(len(stats_data[0])):
-                table[(0, i)].set_facecolor('#4CAF50')
-                table[(0, i)].set_text_props(weight='bold', color='white')
-            
-            ax3.set_title('Summary Statistics', fontweight='bold', pad=20)
-            
-            plt.tight_layout()
-            pdf.savefig(fig, bbox_inches='tight')
-            plt.close()
-        
-        pdf_output.seek(0)
-        
-        return send_file(
-            pdf_output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name='weather_report.pdf'
-        )
-        
+        return run_export('pdf')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/export/<job_id>')
+def export_job(job_id):
+    """Return a queued export once it is ready, or its status until then"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({'error': 'Unknown export job'}), 404
+    
+    kind, future, _ = job
+    if not future.done():
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+    
+    with _jobs_lock:
+        _jobs.pop(job_id, None)
+    
+    try:
+        output = future.result()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if output is None:
+        return jsonify({'error': 'No data available for the last 48 hours'}), 404
+    
+    _, mimetype, download_name = EXPORTS[kind]
+    return send_file(output, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
 if __name__ == '__main__':
     # Initialize database
     init_db()